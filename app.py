@@ -1,15 +1,23 @@
 # app.py
 import os
+import math
 import base64
-import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
-from flask import Flask, render_template, request, send_file
+import orjson
+from flask import Flask, Response, render_template, request, send_file
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.schema import CreateIndex, CreateTable
 from sqlalchemy.exc import OperationalError
 from reportlab.platypus import Table, TableStyle, SimpleDocTemplate, Paragraph, Spacer, Image
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
 
 # -------------------------
 # Flask setup
@@ -20,143 +28,337 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DB_PATH = os.path.join(BASE_DIR, "tax_records.db")
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Pooled connections shared across gunicorn threads; with WAL (below) readers
+# don't block while another thread commits, and writers wait instead of failing.
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "connect_args": {"check_same_thread": False, "timeout": 30},
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_pre_ping": True,
+}
 
 db = SQLAlchemy(app)
 
+# WAL lets readers proceed while a record is being written and, with
+# synchronous=NORMAL, commits skip the rollback journal's double fsync.
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+with app.app_context():
+    event.listen(db.engine, "connect", set_sqlite_pragmas)
+
+def remove_db_files():
+    # A WAL database is three files; a fresh DB next to a stale -wal/-shm
+    # can replay old frames or fail with "disk I/O error".
+    db.engine.dispose()
+    for path in (DB_PATH, DB_PATH + "-wal", DB_PATH + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
 # -------------------------
 # DB model
 # -------------------------
+# All amounts are stored as integer kobo (naira x 100).
 class TaxRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    annual_income = db.Column(db.Float)
-    total_deductions = db.Column(db.Float)
-    taxable_old = db.Column(db.Float)
-    tax_old = db.Column(db.Float)
-    taxable_new = db.Column(db.Float)
-    tax_new = db.Column(db.Float)
-    net_annual_old = db.Column(db.Float)
-    net_annual_new = db.Column(db.Float)
-    net_monthly_old = db.Column(db.Float)
-    net_monthly_new = db.Column(db.Float)
+    annual_income = db.Column(db.Integer, index=True)
+    total_deductions = db.Column(db.Integer)
+    taxable_old = db.Column(db.Integer)
+    tax_old = db.Column(db.Integer)
+    taxable_new = db.Column(db.Integer)
+    tax_new = db.Column(db.Integer)
+    net_annual_old = db.Column(db.Integer)
+    net_annual_new = db.Column(db.Integer)
+    net_monthly_old = db.Column(db.Integer)
+    net_monthly_new = db.Column(db.Integer)
+
+def migrate_amounts_to_kobo():
+    # Databases created before the switch to kobo hold float naira columns;
+    # rebuild the table with the current schema and convert the rows over.
+    # Run once per start via `flask migrate-db` (gunicorn.conf.py does this
+    # before forking workers), never from worker import. SQLite DDL is
+    # transactional, so the rename, rebuild and copy commit together.
+    table = TaxRecord.__table__
+    legacy = f"{table.name}_naira"
+    amounts = [c.name for c in table.columns if c.name != "id"]
+    conn = db.engine.raw_connection()
+    dbapi_connection = conn.driver_connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None  # pysqlite won't BEGIN before DDL itself
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Checked under the write lock, so a concurrent run sees our result
+            types = {row[1]: row[2].upper() for row in cursor.execute(f"PRAGMA table_info({table.name})")}
+            rebuilt = types.get("annual_income", "INTEGER") != "INTEGER"
+            if rebuilt:
+                cursor.execute(f"ALTER TABLE {table.name} RENAME TO {legacy}")
+                for index in table.indexes:
+                    cursor.execute(f"DROP INDEX IF EXISTS {index.name}")
+                cursor.execute(str(CreateTable(table).compile(db.engine)))
+            for index in table.indexes:
+                cursor.execute(str(CreateIndex(index, if_not_exists=True).compile(db.engine)))
+            # Also picks up rows left behind by an interrupted earlier migration
+            if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (legacy,)).fetchone():
+                columns = (["id"] if rebuilt else []) + amounts
+                converted = [f"CAST(ROUND({c} * 100) AS INTEGER)" for c in amounts]
+                cursor.execute(
+                    f"INSERT INTO {table.name} ({', '.join(columns)}) "
+                    f"SELECT {', '.join((['id'] if rebuilt else []) + converted)} "
+                    f"FROM {legacy} ORDER BY id")
+                cursor.execute(f"DROP TABLE {legacy}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        dbapi_connection.isolation_level = isolation_level
+        conn.close()
+
+@app.cli.command("migrate-db")
+def migrate_db_command():
+    """Bring tax_records.db up to the current schema."""
+    migrate_amounts_to_kobo()
 
 with app.app_context():
     try:
         db.create_all()
     except OperationalError:
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
+        remove_db_files()
         db.create_all()
 
+# Records are written off the request path. SQLite only has one writer at a
+# time, so a single worker keeps inserts in order without lock contention;
+# queued writes are still flushed when the interpreter exits.
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tax-record")
+
+def save_record(values):
+    try:
+        with app.app_context():
+            db.session.execute(TaxRecord.__table__.insert(), [values])
+            db.session.commit()
+    except Exception as e:
+        print("Failed to save tax record:", e)
+
 # -------------------------
 # Helpers
 # -------------------------
+# Thousands separators users type into amount fields ("1,200,000", "1 200 000")
+_AMOUNT_TRANS = str.maketrans("", "", ", ")
+
 def parse_amount(text):
-    if text is None or text.strip() == "":
+    if not text:
         return 0.0
+    # float() already ignores surrounding whitespace; blank input fails below
     try:
-        return float(text.replace(",", "").replace(" ", ""))
+        return float(text.translate(_AMOUNT_TRANS))
     except ValueError:
         return 0.0
 
+# Tax math runs on integer kobo so band sums are exact; amounts are rounded
+# half up to the kobo once, here, and converted back to naira only for display.
+# Inputs are clamped to +/-N100 trillion so every derived total (statutory
+# deductions sum 51 of them) still fits SQLite's 64-bit INTEGER.
+MAX_KOBO = 10**16
+
+def parse_kobo(text):
+    amount = parse_amount(text)
+    if not math.isfinite(amount):  # "inf", "nan"
+        return 0
+    # amount * 100 can itself overflow to inf; the clamp absorbs that too
+    kobo = max(-MAX_KOBO, min(MAX_KOBO, amount * 100))
+    return math.floor(kobo + 0.5)
+
+def percent_of(kobo, percent):
+    # Rounded half up to the nearest kobo, like parse_kobo
+    return (kobo * percent + 50) // 100
+
+def naira(kobo):
+    return kobo / 100
+
 def format_amount(num):
     try:
-        return f"₦{float(num):,.2f}" if num is not None else "₦0.00"
+        return f"₦{float(num) / 100:,.2f}" if num is not None else "₦0.00"
     except Exception:
         return "₦0.00"
 
-app.jinja_env.globals.update(format_amount=format_amount)
+def breakdown_json(breakdown):
+    # Rows of [amount, rate, tax] in naira and fractional rates for the PDF form
+    return orjson.dumps([[naira(amt), rate / 100, naira(tax)] for amt, rate, tax in zip(*breakdown)]).decode()
+
+# Display rows (amount, rate, tax, bar width %) for the result page, formatted
+# here once per distinct breakdown rather than through Jinja on every render.
+@lru_cache(maxsize=4096)
+def breakdown_rows(breakdown, total_tax):
+    return tuple((format_amount(amt), f"{rate}%", format_amount(tax),
+                  f"{tax / total_tax * 100:.2f}" if total_tax else "0")
+                 for amt, rate, tax in zip(*breakdown))
+
+app.jinja_env.globals.update(format_amount=format_amount, naira=naira, breakdown_json=breakdown_json)
 
 # -------------------------
 # CRA (Old law)
 # -------------------------
+@lru_cache(maxsize=4096)
 def compute_cra(gross_income, pension_annual):
-    part1 = max(200_000.0, 0.01 * gross_income)
-    part2 = 0.20 * max(0.0, gross_income - pension_annual)
+    part1 = max(20_000_000, percent_of(gross_income, 1))
+    part2 = percent_of(max(0, gross_income - pension_annual), 20)
     return part1 + part2
 
 # -------------------------
 # Tax brackets
 # -------------------------
+# (band width in kobo, rate in whole percent)
 OLD_BRACKETS = [
-    (300_000, 0.07),
-    (300_000, 0.11),
-    (500_000, 0.15),
-    (500_000, 0.19),
-    (1_600_000, 0.21),
-    (float("inf"), 0.24)
+    (30_000_000, 7),
+    (30_000_000, 11),
+    (50_000_000, 15),
+    (50_000_000, 19),
+    (160_000_000, 21),
+    (float("inf"), 24)
 ]
 
 NEW_BRACKETS = [
-    (800_000, 0.00),
-    (2_200_000, 0.15),
-    (9_000_000, 0.18),
-    (13_000_000, 0.21),
-    (25_000_000, 0.23),
-    (float("inf"), 0.25)
+    (80_000_000, 0),
+    (220_000_000, 15),
+    (900_000_000, 18),
+    (1_300_000_000, 21),
+    (2_500_000_000, 23),
+    (float("inf"), 25)
 ]
 
-def apply_brackets(taxable_income, brackets):
-    remaining = taxable_income
-    total_tax = 0.0
-    breakdown = []
-    for limit, rate in brackets:
-        if remaining <= 0:
-            break
-        amount = min(remaining, limit)
-        tax = amount * rate
-        breakdown.append((amount, rate, tax))
-        total_tax += tax
-        remaining -= amount
-    return total_tax, breakdown
+# The bracket tables never change, so each one is compiled at import into a
+# straight-line function with its limits and rates inlined as literals.
+# Band i only runs when income is left after bands 0..i-1, exactly like
+# walking the table, and the result is (total_tax, amounts, rates, taxes)
+# with the breakdown held as parallel tuples.
+def specialize_brackets(name, brackets):
+    amounts, rates, taxes = [], [], []
+
+    def result():
+        return (f"{' + '.join(taxes) or '0'}, ({''.join(a + ', ' for a in amounts)}), "
+                f"({''.join(r + ', ' for r in rates)}), ({''.join(x + ', ' for x in taxes)})")
 
+    lines = [f"def {name}(t):"]
+    for i, (limit, rate) in enumerate(brackets):
+        lines += ["    if t <= 0:", f"        return {result()}"]
+        if limit == float("inf"):
+            lines.append(f"    a{i} = t")
+        else:
+            lines.append(f"    a{i} = t if t < {limit} else {limit}")
+            lines.append(f"    t -= a{i}")
+        lines.append(f"    x{i} = (a{i} * {rate} + 50) // 100")
+        amounts.append(f"a{i}")
+        rates.append(str(rate))
+        taxes.append(f"x{i}")
+    lines.append(f"    return {result()}")
+
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace[name]
+
+_apply_old = specialize_brackets("_apply_old", OLD_BRACKETS)
+_apply_new = specialize_brackets("_apply_new", NEW_BRACKETS)
+
+@lru_cache(maxsize=4096)
 def rent_relief_calc(annual_rent):
-    return min(500_000.0, 0.20 * annual_rent)
+    return min(50_000_000, percent_of(annual_rent, 20))
+
+# -------------------------
+# Tax computation
+# -------------------------
+# Pure function of the parsed form inputs; the route only parses, saves and renders.
+# Results are immutable tuples, so re-submitted forms can be served from the cache.
+@lru_cache(maxsize=4096)
+def compute_taxes(annual_income, pension_month, voluntary_pension_month, health_month,
+                  life_insurance_month, rent_annual, nhf_annual, nhis_annual,
+                  interest_owner_annual):
+    # annualize the monthly deductions with one multiply; CRA still needs pension alone
+    pension_annual = pension_month * 12
+    statutory = ((pension_month + voluntary_pension_month + health_month + life_insurance_month) * 12 +
+                 nhf_annual + nhis_annual + interest_owner_annual)
+
+    # --- OLD LAW ---
+    cra = compute_cra(annual_income, pension_annual)
+    taxable_old = max(0, annual_income - statutory - cra)
+    tax_old, amounts_old, rates_old, taxes_old = _apply_old(taxable_old)
+    breakdown_old = (amounts_old, rates_old, taxes_old)
+    net_annual_old = annual_income - tax_old
+    net_monthly_old = (net_annual_old + 6) // 12 if annual_income else 0
+
+    # --- NEW LAW ---
+    rent_relief = rent_relief_calc(rent_annual)
+    taxable_new = max(0, annual_income - statutory - rent_relief)
+    tax_new, amounts_new, rates_new, taxes_new = _apply_new(taxable_new)
+    breakdown_new = (amounts_new, rates_new, taxes_new)
+    net_annual_new = annual_income - tax_new
+    net_monthly_new = (net_annual_new + 6) // 12 if annual_income else 0
+
+    return (cra, statutory, rent_relief,
+            taxable_old, tax_old, breakdown_old,
+            taxable_new, tax_new, breakdown_new,
+            net_annual_old, net_annual_new,
+            net_monthly_old, net_monthly_new)
 
 # -------------------------
 # Routes
 # -------------------------
+# index.html has no per-request variables, so it is rendered once per process
+# and served with an ETag that lets returning browsers get a 304.
+_INDEX_HTML = None
+_INDEX_ETAG = None
+
+# Form fields posted by index.html, in compute_taxes argument order
+INPUT_FIELDS = ("annual_income",
+                "pension", "voluntary_pension", "health", "life_insurance",
+                "rent_annual", "nhf_annual", "nhis_annual", "interest_owner_annual")
+
+def index_page():
+    global _INDEX_HTML, _INDEX_ETAG
+    if _INDEX_HTML is None or app.debug:
+        html = render_template("index.html").encode()
+        _INDEX_ETAG = hashlib.md5(html).hexdigest()
+        _INDEX_HTML = html
+    response = Response(_INDEX_HTML, mimetype="text/html")
+    response.set_etag(_INDEX_ETAG)
+    return response.make_conditional(request)
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
-        annual_income = parse_amount(request.form.get("annual_income"))
-        # monthly deductions
-        pension_month = parse_amount(request.form.get("pension"))
-        voluntary_pension_month = parse_amount(request.form.get("voluntary_pension"))
-        health_month = parse_amount(request.form.get("health"))
-        life_insurance_month = parse_amount(request.form.get("life_insurance"))
-        # annual deductions
-        rent_annual = parse_amount(request.form.get("rent_annual"))
-        nhf_annual = parse_amount(request.form.get("nhf_annual"))
-        nhis_annual = parse_amount(request.form.get("nhis_annual"))
-        interest_owner_annual = parse_amount(request.form.get("interest_owner_annual"))
-
-        # annualize monthly deductions
+        form = request.form
+        (annual_income,
+         # monthly deductions
+         pension_month, voluntary_pension_month, health_month, life_insurance_month,
+         # annual deductions
+         rent_annual, nhf_annual, nhis_annual, interest_owner_annual) = [
+            parse_kobo(form.get(field)) for field in INPUT_FIELDS]
+
+        (cra, statutory, rent_relief,
+         taxable_old, tax_old, breakdown_old,
+         taxable_new, tax_new, breakdown_new,
+         net_annual_old, net_annual_new,
+         net_monthly_old, net_monthly_new) = compute_taxes(
+            annual_income, pension_month, voluntary_pension_month, health_month,
+            life_insurance_month, rent_annual, nhf_annual, nhis_annual,
+            interest_owner_annual)
+
         pension_annual = pension_month * 12
         voluntary_pension_annual = voluntary_pension_month * 12
         health_annual = health_month * 12
         life_insurance_annual = life_insurance_month * 12
-
-        statutory = (pension_annual + voluntary_pension_annual + health_annual +
-                     life_insurance_annual + nhf_annual + nhis_annual + interest_owner_annual)
-
-        # --- OLD LAW ---
-        cra = compute_cra(annual_income, pension_annual)
-        taxable_old = max(0.0, annual_income - statutory - cra)
-        tax_old, breakdown_old = apply_brackets(taxable_old, OLD_BRACKETS)
-        net_annual_old = annual_income - tax_old
-        net_monthly_old = net_annual_old / 12 if annual_income else 0.0
         total_deductions_old = statutory + cra
-
-        # --- NEW LAW ---
-        rent_relief = rent_relief_calc(rent_annual)
-        taxable_new = max(0.0, annual_income - statutory - rent_relief)
-        tax_new, breakdown_new = apply_brackets(taxable_new, NEW_BRACKETS)
-        net_annual_new = annual_income - tax_new
-        net_monthly_new = net_annual_new / 12 if annual_income else 0.0
         total_deductions_new = statutory + rent_relief
 
-        # Save record
-        record = TaxRecord(
+        # Save record in the background (Core insert, no ORM unit of work needed)
+        _DB_EXECUTOR.submit(save_record, dict(
             annual_income=annual_income,
             total_deductions=total_deductions_new,
             taxable_old=taxable_old,
@@ -167,9 +369,7 @@ def index():
             net_annual_new=net_annual_new,
             net_monthly_old=net_monthly_old,
             net_monthly_new=net_monthly_new
-        )
-        db.session.add(record)
-        db.session.commit()
+        ))
 
         effective_rate_old = (tax_old / annual_income * 100) if annual_income else 0.0
         effective_rate_new = (tax_new / annual_income * 100) if annual_income else 0.0
@@ -193,95 +393,233 @@ def index():
                                taxable_old=taxable_old,
                                tax_old=tax_old,
                                breakdown_old=breakdown_old,
+                               breakdown_old_rows=breakdown_rows(breakdown_old, tax_old),
                                net_annual_old=net_annual_old,
                                net_monthly_old=net_monthly_old,
                                taxable_new=taxable_new,
                                tax_new=tax_new,
                                breakdown_new=breakdown_new,
+                               breakdown_new_rows=breakdown_rows(breakdown_new, tax_new),
                                net_annual_new=net_annual_new,
                                net_monthly_new=net_monthly_new,
                                effective_rate_old=effective_rate_old,
                                effective_rate_new=effective_rate_new,
                                savings=savings)
-    return render_template("index.html")
+    return index_page()
 
 # -------------------------
-# PDF Export with full breakdown
+# PDF styles (built once, shared by every export)
 # -------------------------
-@app.route("/download_pdf", methods=["POST"])
-def download_pdf():
-    annual_income = parse_amount(request.form.get("annual_income"))
-    tax_old = parse_amount(request.form.get("tax_old"))
-    tax_new = parse_amount(request.form.get("tax_new"))
-    net_annual_old = parse_amount(request.form.get("net_annual_old"))
-    net_annual_new = parse_amount(request.form.get("net_annual_new"))
-    chart_image = request.form.get("chart_image")
+_STYLES = getSampleStyleSheet()
+_TITLE = _STYLES["Heading2"]
+_NORMAL = _STYLES["Normal"]
+_H3 = _STYLES["Heading3"]
 
-    # Get breakdowns from JSON passed from frontend
-    breakdown_old = json.loads(request.form.get("breakdown_old", "[]"))
-    breakdown_new = json.loads(request.form.get("breakdown_new", "[]"))
+_TS_OLD = TableStyle([
+    ('BACKGROUND',(0,0),(-1,0),colors.lightblue),
+    ('TEXTCOLOR',(0,0),(-1,0),colors.white),
+    ('ALIGN',(0,0),(-1,-1),'CENTER'),
+    ('GRID',(0,0),(-1,-1),1,colors.black)
+])
+
+_TS_NEW = TableStyle([
+    ('BACKGROUND',(0,0),(-1,0),colors.green),
+    ('TEXTCOLOR',(0,0),(-1,0),colors.white),
+    ('ALIGN',(0,0),(-1,-1),'CENTER'),
+    ('GRID',(0,0),(-1,-1),1,colors.black)
+])
+
+# -------------------------
+# PDF rendering
+# -------------------------
+# The report is a fixed layout (title, two band tables, chart), so it is drawn
+# straight onto a canvas. Breakdowns longer than the six statutory bands can
+# only come from a hand-crafted form post; those go through Platypus, which
+# handles pagination for us.
+PDF_TITLE = "Nigeria Personal Income Tax Comparison (Old vs New)"
+PDF_FILENAME = "nigeria_pit_comparison.pdf"
+PDF_MAX_BANDS = 6
+_PAGE_W, _PAGE_H = A4
+_MARGIN = 72
+_COL_W = 110
+_ROW_H = 18
+_CHART_W, _CHART_H = 480, 300
+
+# The chart comes from the client, so its size is bounded: Chart.js exports
+# at devicePixelRatio scale, and anything past CHART_MAX_PIXELS is refused
+# before it is decoded. Only charts up to CHART_CACHE_MAX_PIXELS (a few MB
+# decoded) are kept in the cache; larger ones are decoded per export.
+CHART_MAX_PIXELS = 4000 * 4000
+CHART_CACHE_MAX_PIXELS = 8 * _CHART_W * _CHART_H
+
+def chart_size(image_data):
+    # ImageReader only reads the PNG header here; pixels are decoded lazily
+    return ImageReader(BytesIO(image_data)).getSize()
+
+def chart_reader(image_data):
+    width, height = chart_size(image_data)
+    if width * height > CHART_CACHE_MAX_PIXELS:
+        return ImageReader(BytesIO(image_data))
+    return _cached_chart_reader(image_data)
+
+# ImageReader keeps the decoded RGB/alpha data that drawImage embeds, so
+# re-exporting the same chart skips decoding the PNG again.
+@lru_cache(maxsize=8)
+def _cached_chart_reader(image_data):
+    return _decode_reader(ImageReader(BytesIO(image_data)))
 
+def _decode_reader(reader):
+    # getRGBData() lazily rewrites mode/_data and builds the alpha channel's
+    # own reader in the private _dataA on first call. Do all of that before
+    # the cache shares the reader between gunicorn threads, so drawImage only
+    # reads from it. Checked against ReportLab 4.4.4 (pinned) and 5.0.1.
+    reader.getSize()
+    reader.getRGBData()
+    if reader._dataA:
+        reader._dataA.getSize()
+        reader._dataA.getRGBData()
+    return reader
+
+def _draw_table(c, top, data, header_color):
+    x0 = (_PAGE_W - 3 * _COL_W) / 2
+    c.setFillColor(header_color)
+    c.rect(x0, top - _ROW_H, 3 * _COL_W, _ROW_H, stroke=0, fill=1)
+    c.setFont("Helvetica", 10)
+    for i, row in enumerate(data):
+        c.setFillColor(colors.white if i == 0 else colors.black)
+        baseline = top - (i + 1) * _ROW_H + 6
+        for j, cell in enumerate(row):
+            c.drawCentredString(x0 + (j + 0.5) * _COL_W, baseline, cell)
+    c.setStrokeColor(colors.black)
+    c.setLineWidth(1)
+    c.grid([x0 + j * _COL_W for j in range(4)],
+           [top - i * _ROW_H for i in range(len(data) + 1)])
+    return top - len(data) * _ROW_H
+
+def render_pdf_canvas(annual_income, data_old, data_new, image_data):
+    c = canvas.Canvas(BytesIO(), pagesize=A4)
+    y = _PAGE_H - _MARGIN
+
+    y -= 18
+    c.setFont("Helvetica-Bold", 14)
+    c.setFillColor(colors.black)
+    c.drawString(_MARGIN, y, PDF_TITLE)
+    y -= 30
+    c.setFont("Helvetica", 10)
+    c.drawString(_MARGIN, y, f"Annual Gross Income: ₦{annual_income:,.2f}")
+    y -= 12
+
+    for heading, data, header_color in (("Old Law Detailed Breakdown", data_old, colors.lightblue),
+                                        ("New Law Detailed Breakdown", data_new, colors.green)):
+        y -= 24
+        c.setFont("Helvetica-BoldOblique", 12)
+        c.setFillColor(colors.black)
+        c.drawString(_MARGIN, y, heading)
+        y = _draw_table(c, y - 8, data, header_color) - 12
+
+    # Chart
+    if image_data:
+        try:
+            chart = chart_reader(image_data)
+            if y - _CHART_H < _MARGIN:
+                c.showPage()
+                y = _PAGE_H - _MARGIN
+            # mask="auto" keeps the PNG's alpha channel, as Platypus' Image does;
+            # without it Chart.js' transparent background comes out black
+            c.drawImage(chart, (_PAGE_W - _CHART_W) / 2, y - _CHART_H, width=_CHART_W, height=_CHART_H,
+                        mask="auto")
+        except Exception as e:
+            print("Failed to embed chart:", e)
+
+    c.showPage()
+    return c.getpdfdata()
+
+def render_pdf_platypus(annual_income, data_old, data_new, image_data):
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
     elements = []
-    styles = getSampleStyleSheet()
-    title_style = styles["Heading2"]
-    normal = styles["Normal"]
 
-    elements.append(Paragraph("Nigeria Personal Income Tax Comparison (Old vs New)", title_style))
+    elements.append(Paragraph(PDF_TITLE, _TITLE))
     elements.append(Spacer(1,12))
-    elements.append(Paragraph(f"Annual Gross Income: ₦{annual_income:,.2f}", normal))
+    elements.append(Paragraph(f"Annual Gross Income: ₦{annual_income:,.2f}", _NORMAL))
     elements.append(Spacer(1,12))
 
     # Old Law Table
-    elements.append(Paragraph("Old Law Detailed Breakdown", styles["Heading3"]))
-    data_old = [["Band Amount (₦)","Rate (%)","Tax (₦)"]]
-    for amt, rate, tax in breakdown_old:
-        data_old.append([f"₦{amt:,.2f}", f"{rate*100:.2f}", f"₦{tax:,.2f}"])
-    data_old.append(["-","Total Tax", f"₦{tax_old:,.2f}"])
-    data_old.append(["-","Net Annual", f"₦{net_annual_old:,.2f}"])
+    elements.append(Paragraph("Old Law Detailed Breakdown", _H3))
     table_old = Table(data_old)
-    table_old.setStyle(TableStyle([
-        ('BACKGROUND',(0,0),(-1,0),colors.lightblue),
-        ('TEXTCOLOR',(0,0),(-1,0),colors.white),
-        ('ALIGN',(0,0),(-1,-1),'CENTER'),
-        ('GRID',(0,0),(-1,-1),1,colors.black)
-    ]))
+    table_old.setStyle(_TS_OLD)
     elements.append(table_old)
     elements.append(Spacer(1,12))
 
     # New Law Table
-    elements.append(Paragraph("New Law Detailed Breakdown", styles["Heading3"]))
-    data_new = [["Band Amount (₦)","Rate (%)","Tax (₦)"]]
-    for amt, rate, tax in breakdown_new:
-        data_new.append([f"₦{amt:,.2f}", f"{rate*100:.2f}", f"₦{tax:,.2f}"])
-    data_new.append(["-","Total Tax", f"₦{tax_new:,.2f}"])
-    data_new.append(["-","Net Annual", f"₦{net_annual_new:,.2f}"])
+    elements.append(Paragraph("New Law Detailed Breakdown", _H3))
     table_new = Table(data_new)
-    table_new.setStyle(TableStyle([
-        ('BACKGROUND',(0,0),(-1,0),colors.green),
-        ('TEXTCOLOR',(0,0),(-1,0),colors.white),
-        ('ALIGN',(0,0),(-1,-1),'CENTER'),
-        ('GRID',(0,0),(-1,-1),1,colors.black)
-    ]))
+    table_new.setStyle(_TS_NEW)
     elements.append(table_new)
     elements.append(Spacer(1,12))
 
     # Chart
-    if chart_image:
+    if image_data:
         try:
-            image_data = base64.b64decode(chart_image.split(",")[1])
-            img = Image(BytesIO(image_data), width=480, height=300)
+            img = Image(BytesIO(image_data), width=_CHART_W, height=_CHART_H)
             elements.append(img)
         except Exception as e:
             print("Failed to embed chart:", e)
 
     doc.build(elements)
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name="nigeria_pit_comparison.pdf", mimetype="application/pdf")
+    return buffer.getvalue()
+
+# -------------------------
+# PDF Export with full breakdown
+# -------------------------
+@app.route("/download_pdf", methods=["POST"])
+def download_pdf():
+    form = request.form
+    annual_income = parse_amount(form.get("annual_income"))
+    tax_old = parse_amount(form.get("tax_old"))
+    tax_new = parse_amount(form.get("tax_new"))
+    net_annual_old = parse_amount(form.get("net_annual_old"))
+    net_annual_new = parse_amount(form.get("net_annual_new"))
+    chart_image = form.get("chart_image")
+
+    # Get breakdowns from JSON passed from frontend
+    breakdown_old = orjson.loads(form.get("breakdown_old", "[]"))
+    breakdown_new = orjson.loads(form.get("breakdown_new", "[]"))
+
+    data_old = ([["Band Amount (₦)","Rate (%)","Tax (₦)"]] +
+                [[f"₦{amt:,.2f}", f"{rate*100:.2f}", f"₦{tax:,.2f}"] for amt, rate, tax in breakdown_old] +
+                [["-","Total Tax", f"₦{tax_old:,.2f}"],
+                 ["-","Net Annual", f"₦{net_annual_old:,.2f}"]])
+    data_new = ([["Band Amount (₦)","Rate (%)","Tax (₦)"]] +
+                [[f"₦{amt:,.2f}", f"{rate*100:.2f}", f"₦{tax:,.2f}"] for amt, rate, tax in breakdown_new] +
+                [["-","Total Tax", f"₦{tax_new:,.2f}"],
+                 ["-","Net Annual", f"₦{net_annual_new:,.2f}"]])
+
+    image_data = None
+    if chart_image:
+        try:
+            # Decode everything after the first comma, i.e. past the
+            # "data:image/png;base64," prefix
+            start = chart_image.find(",") + 1
+            decoded = base64.b64decode(chart_image[start:])
+            width, height = chart_size(decoded)
+            if width * height > CHART_MAX_PIXELS:
+                raise ValueError(f"chart is {width}x{height}px, over the {CHART_MAX_PIXELS}px limit")
+            image_data = decoded
+        except Exception as e:
+            print("Failed to embed chart:", e)
+
+    if len(breakdown_old) <= PDF_MAX_BANDS and len(breakdown_new) <= PDF_MAX_BANDS:
+        pdf = render_pdf_canvas(annual_income, data_old, data_new, image_data)
+    else:
+        pdf = render_pdf_platypus(annual_income, data_old, data_new, image_data)
+    # BytesIO over an existing bytes object shares it rather than copying
+    return send_file(BytesIO(pdf), as_attachment=True, download_name=PDF_FILENAME, mimetype="application/pdf")
 
 # -------------------------
 # Run app
 # -------------------------
 if __name__ == "__main__":
+    with app.app_context():
+        migrate_amounts_to_kobo()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,11 @@
+# gunicorn.conf.py -- read automatically when gunicorn starts in this directory
+import os
+import subprocess
+import sys
+
+def on_starting(server):
+    # Schema migrations run once, in their own process, before the master
+    # forks any workers; a failure stops startup instead of serving a
+    # half-migrated database.
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "migrate-db"],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=True)